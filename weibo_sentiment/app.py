@@ -2,19 +2,83 @@
 
 from __future__ import annotations
 
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
-from typing import Dict, List, Optional, Sequence
+from types import ModuleType
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
 
-import pandas as pd
 import streamlit as st
 
 import crawler
 import db
-import sentiment
 import utils
 
+if TYPE_CHECKING:
+    import pandas as pd
+
+    import sentiment
+
 st.set_page_config(page_title="微博情绪分析", layout="wide")
-db.init_db()
+
+STREAM_BATCH_SIZE = 32
+PREFETCH_BATCHES = 4
+
+T = TypeVar("T")
+
+
+@lru_cache(maxsize=1)
+def _get_sentiment() -> ModuleType:
+    """Import the sentiment module on first use rather than at app start-up."""
+    import sentiment
+
+    return sentiment
+
+
+@st.cache_resource(show_spinner="正在加载情绪模型，请稍候...")
+def load_analyzer() -> sentiment.SentimentAnalyzer:
+    """Load the sentiment model once per process."""
+    analyzer = _get_sentiment().get_analyzer()
+    analyzer.warm_up()
+    return analyzer
+
+
+@st.cache_resource(ttl=3600)
+def get_weibo_client() -> crawler.WeiboClient:
+    """Share one visitor session (cookies + pooled connections) per process."""
+    return crawler.WeiboClient()
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def pie_figure(dist_items: Tuple[Tuple[str, float], ...]):
+    """Cached pie chart keyed on the (emotion, share) pairs."""
+    return utils.draw_pie(dict(dist_items))
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def wordcloud_figure(freq_items: Tuple[Tuple[str, int], ...]):
+    """Cached word cloud keyed on token frequencies rather than raw text."""
+    return utils.draw_wordcloud_from_frequencies(dict(freq_items))
+
+
+def predict_emotions(
+    texts: Sequence[str], thresh: float = 0.5
+) -> Tuple[List[List[float]], List[List[str]]]:
+    result = load_analyzer().predict(texts, thresh=thresh)
+    return result.probabilities, result.labels
 
 
 def main() -> None:
@@ -45,55 +109,127 @@ def render_url_tab() -> None:
 
     if st.button("开始采集并分析", width='stretch', disabled=not url):
         try:
-            with st.spinner("抓取评论并执行情绪分析..."):
-                post_meta, comments = crawler.fetch_post_with_comments(url, max_comments=max_comments)
+            with st.spinner("获取帖子信息..."):
+                post_meta, comment_stream = crawler.stream_post_comments(
+                    url, max_comments=max_comments, client=get_weibo_client()
+                )
         except Exception as exc:
             st.error(f"采集失败：{exc}")
             return
 
-        if not comments:
-            st.warning("未成功抓取到评论，请检查链接或稍后重试。")
-            return
-
         if title:
             post_meta["title"] = title
         if topic:
             post_meta["topic"] = topic
 
-        st.success(f"共采集 {len(comments)} 条评论，分析完成。")
-
-        post_id = db.insert_post(
-            {
-                "url": post_meta.get("url") or url,
-                "title": post_meta.get("title") or "未命名热帖",
-                "topic": post_meta.get("topic") or "",
-                "like_cnt": post_meta.get("like_cnt"),
-                "repost_cnt": post_meta.get("repost_cnt"),
-                "comment_cnt": len(comments),
-            }
-        )
-        comment_ids = db.insert_comments(post_id, comments)
+        post_id: Optional[int] = None
+        comments: List[Dict[str, object]] = []
+        prob_list: List[List[float]] = []
+        label_list: List[List[str]] = []
+        progress = st.progress(0.0, text="抓取评论并执行情绪分析...")
+        try:
+            for batch in iter_batches_in_background(comment_stream, STREAM_BATCH_SIZE):
+                # 空白评论无法分析，丢弃以保持与预测结果一一对应
+                rows = [comment.to_dict() for comment in batch if comment.text]
+                if not rows:
+                    continue
+                if post_id is None:
+                    post_id = db.insert_post(
+                        {
+                            "url": post_meta.get("url") or url,
+                            "title": post_meta.get("title") or "未命名热帖",
+                            "topic": post_meta.get("topic") or "",
+                            "like_cnt": post_meta.get("like_cnt"),
+                            "repost_cnt": post_meta.get("repost_cnt"),
+                            "comment_cnt": 0,
+                        }
+                    )
+                probs, labels = predict_emotions([row["text"] for row in rows])
+                db.insert_analyzed_comments(post_id, rows, probs, labels)
+                comments.extend(rows)
+                prob_list.extend(probs)
+                label_list.extend(labels)
+                progress.progress(
+                    min(len(comments) / max_comments, 1.0),
+                    text=f"已分析 {len(comments)} 条评论...",
+                )
+        except Exception as exc:
+            st.error(f"采集失败：{exc}")
+            return
+        finally:
+            progress.empty()
 
-        texts = [comment["text"] for comment in comments]
-        prob_list, label_list = sentiment.predict(texts)
-        db.insert_emotions(prob_list, label_list, comment_ids)
+        if post_id is None:
+            st.warning("未成功抓取到评论，请检查链接或稍后重试。")
+            return
 
+        db.update_comment_count(post_id, len(comments))
+        st.success(f"共采集 {len(comments)} 条评论，分析完成。")
         render_analysis_results(post_id, comments, prob_list, label_list, post_meta=post_meta)
 
 
+def iter_batches(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Group an iterable into lists of at most ``size`` items."""
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def iter_batches_in_background(
+    items: Iterable[T], size: int, prefetch: int = PREFETCH_BATCHES
+) -> Iterator[List[T]]:
+    """Like ``iter_batches`` but consumes ``items`` on a worker thread.
+
+    Crawling (network bound) keeps running while the caller analyses the
+    previous batch. Errors raised by ``items`` are re-raised to the caller;
+    closing the generator early tells the worker to stop.
+    """
+    batches: queue.Queue = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    done = object()
+
+    def put(item: object) -> bool:
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for batch in iter_batches(items, size):
+                if not put(batch):
+                    return
+        finally:
+            put(done)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(produce)
+        try:
+            while (batch := batches.get()) is not done:
+                yield batch
+            future.result()
+        finally:
+            stop.set()
+
+
 def render_text_tab() -> None:
     st.subheader("单条评论即时分析")
     text = st.text_area("请输入微博评论内容")
     threshold = st.slider("情绪标签阈值", min_value=0.1, max_value=0.9, value=0.5, step=0.05)
 
     if st.button("分析文本", disabled=not text.strip()):
-        prob_list, label_list = sentiment.predict([text], thresh=threshold)
+        prob_list, label_list = predict_emotions([text], thresh=threshold)
         if not prob_list:
             st.info("未能分析该文本，请重试。")
             return
+        import pandas as pd
+
         table = pd.DataFrame(
             [prob_list[0]],
-            columns=sentiment.EMOTIONS,
+            columns=_get_sentiment().EMOTIONS,
         )
         st.write("概率分布")
         st.dataframe(table.style.format("{:.2%}"), width='stretch')
@@ -111,7 +247,7 @@ def render_file_tab() -> None:
             st.warning("未从文件中解析到有效文本。")
             return
         texts = [row["text"] for row in comments]
-        prob_list, label_list = sentiment.predict(texts, thresh=threshold)
+        prob_list, label_list = predict_emotions(texts, thresh=threshold)
         render_analysis_summary(comments, prob_list, label_list)
 
 
@@ -130,33 +266,34 @@ def render_history_tab() -> None:
         st.info("历史记录暂无评论分析结果。")
         return
 
-    prob_list = [
-        [
-            (row["anger"] or 0.0),
-            (row["disgust"] or 0.0),
-            (row["fear"] or 0.0),
-            (row["joy"] or 0.0),
-            (row["sadness"] or 0.0),
-            (row["surprise"] or 0.0),
-        ]
-        for row in comments
-    ]
+    import numpy as np
+    import pandas as pd
+
+    frame = pd.DataFrame(comments, columns=comments[0].keys())
+    emotions = list(_get_sentiment().EMOTIONS)
+    prob_list = frame[emotions].to_numpy(dtype=np.float32, na_value=0.0)
     label_list = [
-        [label for label in (row["top_labels"] or "").split(",") if label] for row in comments
+        [label for label in labels.split(",") if label]
+        for labels in frame["top_labels"].fillna("").tolist()
     ]
-    formatted_comments = []
-    for row in comments:
-        data = dict(row)
-        formatted_comments.append(
-            {
-                "user": data.get("user", "未知用户"),
-                "text": data.get("text", ""),
-                "ts": data.get("ts", ""),
-                "likes": data.get("likes", 0),
-            }
-        )
-    post_meta = next((dict(row) for row in posts if row["id"] == post_id), None)
-    render_analysis_results(post_id, formatted_comments, prob_list, label_list, post_meta=post_meta)
+    formatted_comments = (
+        frame[["user", "text", "ts"]]
+        .fillna({"user": "未知用户", "text": "", "ts": ""})
+        .assign(likes=0)
+        .to_dict("records")
+    )
+    post_meta = next(dict(row) for row in posts if row["id"] == post_id)
+    emotion_dist = {
+        emotion: post_meta[emotion] for emotion in emotions if post_meta[emotion] is not None
+    }
+    render_analysis_results(
+        post_id,
+        formatted_comments,
+        prob_list,
+        label_list,
+        post_meta=post_meta,
+        emotion_dist=emotion_dist,
+    )
 
 
 def render_analysis_results(
@@ -165,6 +302,7 @@ def render_analysis_results(
     prob_list: Sequence[Sequence[float]],
     label_list: Sequence[Sequence[str]],
     post_meta: Optional[Dict[str, object]] = None,
+    emotion_dist: Optional[Dict[str, float]] = None,
 ) -> None:
     if post_meta:
         st.markdown(
@@ -176,15 +314,16 @@ def render_analysis_results(
     st.markdown("#### 评论情绪概览")
     render_analysis_summary(comments, prob_list, label_list)
 
-    dist = db.get_emotion_dist(post_id)
+    dist = emotion_dist or db.get_emotion_dist(post_id)
     if dist:
         col1, col2 = st.columns(2)
         with col1:
-            st.pyplot(utils.draw_pie(dist))
+            st.pyplot(pie_figure(tuple(dist.items())))
         with col2:
             texts = [row["text"] for row in comments if row.get("text")]
-            if texts:
-                st.pyplot(utils.draw_wordcloud(texts))
+            freq = utils.word_frequencies(texts)
+            if freq:
+                st.pyplot(wordcloud_figure(tuple(sorted(freq.items()))))
 
 
 def render_analysis_summary(
@@ -193,7 +332,10 @@ def render_analysis_summary(
     label_list: Sequence[Sequence[str]],
 ) -> None:
     dataframe = build_result_dataframe(comments, prob_list, label_list)
-    st.dataframe(dataframe, width='stretch')
+    styled = dataframe.style.format(
+        {emotion: "{:.1%}" for emotion in _get_sentiment().EMOTIONS}, na_rep=""
+    )
+    st.dataframe(styled, width='stretch')
 
 
 def build_result_dataframe(
@@ -201,25 +343,43 @@ def build_result_dataframe(
     prob_list: Sequence[Sequence[float]],
     label_list: Sequence[Sequence[str]],
 ) -> pd.DataFrame:
-    probabilities = [
-        {emotion: f"{score:.1%}" for emotion, score in zip(sentiment.EMOTIONS, scores)}
-        for scores in prob_list
-    ]
-    records = []
-    for idx, comment in enumerate(comments):
-        base = {
-            "用户": comment.get("user", "未知用户"),
-            "评论内容": comment.get("text", ""),
-            "时间": comment.get("ts", ""),
-            "情绪标签": "、".join(label_list[idx]) if idx < len(label_list) else "",
-            "点赞数": comment.get("likes", 0),
+    import numpy as np
+    import pandas as pd
+
+    emotions = _get_sentiment().EMOTIONS
+    count = len(comments)
+    probs = np.full((count, len(emotions)), np.nan, dtype=np.float32)
+    filled = min(count, len(prob_list))
+    if filled:
+        probs[:filled] = np.asarray(prob_list[:filled], dtype=np.float32)
+    labels = ["、".join(group) for group in label_list[:count]]
+    labels.extend([""] * (count - len(labels)))
+
+    # Arrow-backed columns hand straight to st.dataframe without re-conversion.
+    text_columns = {
+        "用户": [comment.get("user", "未知用户") for comment in comments],
+        "评论内容": [comment.get("text", "") for comment in comments],
+        "时间": [comment.get("ts", "") for comment in comments],
+        "情绪标签": labels,
+    }
+    columns = {
+        name: pd.array(values, dtype="string[pyarrow]") for name, values in text_columns.items()
+    }
+    columns["点赞数"] = pd.array(
+        [comment.get("likes", 0) for comment in comments], dtype="int64[pyarrow]"
+    )
+    columns.update(
+        {
+            emotion: pd.array(probs[:, idx], dtype="float32[pyarrow]")
+            for idx, emotion in enumerate(emotions)
         }
-        base.update(probabilities[idx] if idx < len(probabilities) else {})
-        records.append(base)
-    return pd.DataFrame(records)
+    )
+    return pd.DataFrame(columns)
 
 
 def load_comments_from_file(uploaded_file) -> List[Dict[str, str]]:
+    import pandas as pd
+
     suffix = Path(uploaded_file.name).suffix.lower()
     if suffix == ".csv":
         df = pd.read_csv(uploaded_file)
@@ -233,7 +393,10 @@ def load_comments_from_file(uploaded_file) -> List[Dict[str, str]]:
         first_column = df.columns[0] if not df.empty else "text"
         df = df.rename(columns={first_column: "text"})
     df = df.dropna(subset=["text"])
-    return [{"user": row.get("user", "批量用户"), "text": row["text"], "ts": row.get("ts", "")} for _, row in df.iterrows()]
+    defaults = {"user": "批量用户", "ts": ""}
+    missing = {column: value for column, value in defaults.items() if column not in df.columns}
+    df = df.assign(**missing)
+    return df[["user", "text", "ts"]].to_dict("records")
 
 
 if __name__ == "__main__":
@@ -6,12 +6,21 @@ import html
 import logging
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from datetime import datetime
-from typing import Dict, Iterator, List, Optional, Tuple, Set
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from itertools import chain, islice
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - fallback when orjson not installed
+    orjson = None
 
 LOGGER = logging.getLogger(__name__)
 
@@ -27,11 +36,29 @@ USER_AGENT = (
     "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
 )
 
-URL_PATTERNS = [
-    re.compile(r"m\.weibo\.cn/(?:status|detail)/(?P<bid>[A-Za-z0-9]+)"),
-    re.compile(r"weibo\.com/\d+/(?P<bid>[A-Za-z0-9]+)"),
-    re.compile(r"weibo\.cn/detail/(?P<bid>[A-Za-z0-9]+)"),
-]
+PAGE_WORKERS = 4
+RETRY_STATUS = (418, 429, 500, 502, 503, 504)
+
+# Supported shapes: m.weibo.cn/status|detail/<bid>, weibo.com/<uid>/<bid>, weibo.cn/detail/<bid>
+URL_RE = re.compile(
+    r"(?:m\.weibo\.cn/(?:status|detail)|weibo\.com/\d+|weibo\.cn/detail)/(?P<bid>[A-Za-z0-9]+)"
+)
+
+_TAG_RE = re.compile(r"</?[A-Za-z!][^>]*>")
+# e.g. "Sat Oct 10 12:30:00 +0800 2026"
+_TS_RE = re.compile(
+    r"[A-Za-z]{3} (?P<mon>[A-Za-z]{3}) (?P<day>\d{2}) "
+    r"(?P<hour>\d{2}):(?P<minute>\d{2}):(?P<second>\d{2}) "
+    r"(?P<sign>[+-])(?P<tzh>\d{2})(?P<tzm>\d{2}) (?P<year>\d{4})$"
+)
+_MONTHS = {
+    name: idx
+    for idx, name in enumerate(
+        ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"),
+        start=1,
+    )
+}
+_TIMEZONES: Dict[str, timezone] = {}
 
 
 @dataclass
@@ -50,14 +77,30 @@ class Comment:
 class WeiboClient:
     """Thin wrapper around requests.Session handling visitor cookies."""
 
-    def __init__(self, timeout: int = 10) -> None:
+    def __init__(self, timeout: int = 10, page_workers: int = PAGE_WORKERS) -> None:
         self.timeout = timeout
+        self.page_workers = max(1, page_workers)
         self.session = requests.Session()
+        retries = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=RETRY_STATUS,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=max(16, self.page_workers),
+            max_retries=retries,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self.session.headers.update(
             {
                 "User-Agent": USER_AGENT,
                 "Accept": "application/json, text/plain, */*",
+                "Accept-Encoding": "gzip, deflate",
                 "Accept-Language": "zh-CN,zh;q=0.9",
+                "Connection": "keep-alive",
                 "X-Requested-With": "XMLHttpRequest",
             }
         )
@@ -70,8 +113,9 @@ class WeiboClient:
         tid = self._generate_tid()
         self._incarnate(tid)
 
-        self.session.headers["Referer"] = referer
-        config_resp = self.session.get(CONFIG, timeout=self.timeout)
+        config_resp = self.session.get(
+            CONFIG, headers={"Referer": referer}, timeout=self.timeout
+        )
         config_resp.raise_for_status()
         xsrf = self.session.cookies.get("XSRF-TOKEN")
         if xsrf:
@@ -107,49 +151,65 @@ class WeiboClient:
         resp = self.session.get(VISITOR, params=params, timeout=self.timeout)
         resp.raise_for_status()
 
-    def fetch_status(self, bid: str) -> Dict[str, object]:
-        self.ensure_ready(referer=f"https://m.weibo.cn/status/{bid}")
-        response = self.session.get(STATUS_SHOW, params={"id": bid}, timeout=self.timeout)
+    def _get(
+        self,
+        url: str,
+        params: Optional[Dict[str, object]] = None,
+        referer: Optional[str] = None,
+    ) -> requests.Response:
+        """GET through the pooled session; rate limits are retried by the adapter.
+
+        The client is shared across posts, so the Referer is sent per request
+        instead of being stored on the session.
+        """
+        headers = {"Referer": referer} if referer else None
+        response = self.session.get(
+            url, params=params, headers=headers, timeout=self.timeout
+        )
         response.raise_for_status()
-        payload = response.json()
+        return response
+
+    def fetch_status(self, bid: str) -> Dict[str, object]:
+        referer = f"https://m.weibo.cn/status/{bid}"
+        self.ensure_ready(referer=referer)
+        response = self._get(STATUS_SHOW, params={"id": bid}, referer=referer)
+        payload = _decode_json(response)
         if payload.get("ok") != 1:
             raise RuntimeError(f"Failed to fetch status info: {payload}")
         return payload["data"]
 
-    def iter_comments(self, status_id: str, max_comments: int) -> Iterator[Comment]:
-        """Yield comments up to max_comments using hot and timeline streams."""
-        seen_ids: Set[str] = set()
-        collected = 0
-
-        for comment_id, comment in self._iter_hot_comments(status_id, max_comments):
-            if comment_id in seen_ids:
-                continue
-            seen_ids.add(comment_id)
-            yield comment
-            collected += 1
-            if collected >= max_comments:
-                return
-
-        for comment_id, comment in self._iter_paginated_comments(
-            status_id, max_comments, seen_ids
-        ):
-            if comment_id in seen_ids:
-                continue
-            seen_ids.add(comment_id)
-            yield comment
-            collected += 1
-            if collected >= max_comments:
-                return
+    def iter_comments(
+        self, status_id: str, max_comments: int, referer: Optional[str] = None
+    ) -> Iterator[Comment]:
+        """Yield comments up to max_comments using hot and timeline streams.
+
+        Both streams share ``seen_ids`` and skip duplicates themselves; pages are
+        only requested as the returned iterator is consumed. Each stream also
+        stops after reading ``max_comments`` raw items, so an API that keeps
+        returning already-seen comments cannot stall the crawl. ``referer``
+        defaults to the post page for ``status_id``.
+        """
+        referer = referer or f"https://m.weibo.cn/status/{status_id}"
+        seen_ids: Set[object] = set()
+        return islice(
+            chain(
+                self._iter_hot_comments(status_id, seen_ids, referer, max_comments),
+                self._iter_paginated_comments(
+                    status_id, seen_ids, referer, max_comments
+                ),
+            ),
+            max_comments,
+        )
 
     def _iter_hot_comments(
-        self, status_id: str, max_comments: int
-    ) -> Iterator[Tuple[str, Comment]]:
+        self, status_id: str, seen_ids: Set[object], referer: str, max_items: int
+    ) -> Iterator[Comment]:
         params = {"id": status_id, "mid": status_id, "max_id": 0, "max_id_type": 0}
+        visited_cursors = {(0, 0)}
         fetched = 0
-        while fetched < max_comments:
-            response = self.session.get(COMMENTS_URL, params=params, timeout=self.timeout)
-            response.raise_for_status()
-            payload = response.json()
+        while fetched < max_items:
+            response = self._get(COMMENTS_URL, params=params, referer=referer)
+            payload = _decode_json(response)
             if payload.get("ok") != 1:
                 break
 
@@ -158,71 +218,118 @@ class WeiboClient:
             if not comments:
                 break
 
+            fetched += len(comments)
+            added = False
             for item in comments:
-                if fetched >= max_comments:
-                    break
-                fetched += 1
-                yield str(item.get("id") or item.get("mid")), Comment(
+                comment_id = _comment_id(item)
+                if comment_id in seen_ids:
+                    continue
+                seen_ids.add(comment_id)
+                added = True
+                yield Comment(
                     user=item.get("user", {}).get("screen_name", "匿名用户"),
                     text=strip_tags(item.get("text", "")),
                     ts=parse_timestamp(item.get("created_at", "")),
                     likes=int(item.get("like_count") or 0),
                 )
 
-            max_id = data.get("max_id")
-            if not max_id:
+            # hotflow 偶尔会循环返回同一页或同一游标，没有新评论就停止
+            cursor = (data.get("max_id"), data.get("max_id_type", 0))
+            if not added or not cursor[0] or cursor in visited_cursors:
                 break
-            params["max_id"] = max_id
-            params["max_id_type"] = data.get("max_id_type", 0)
+            visited_cursors.add(cursor)
+            params["max_id"], params["max_id_type"] = cursor
 
     def _iter_paginated_comments(
-        self, status_id: str, max_comments: int, seen_ids: Set[str]
-    ) -> Iterator[Tuple[str, Comment]]:
+        self,
+        status_id: str,
+        seen_ids: Set[object],
+        referer: str,
+        max_items: int,
+    ) -> Iterator[Comment]:
+        """Walk the page-numbered stream, fetching ``page_workers`` pages at a time."""
+        fetch_page = partial(self._fetch_comment_page, status_id, referer=referer)
         page = 1
         fetched = 0
-        while fetched < max_comments:
-            response = self.session.get(
-                COMMENTS_SHOW_URL,
-                params={"id": status_id, "page": page},
-                timeout=self.timeout,
-            )
-            response.raise_for_status()
-            payload = response.json()
-            if payload.get("ok") != 1:
-                break
-            comments = (payload.get("data") or {}).get("data") or []
-            if not comments:
-                break
+        with ThreadPoolExecutor(max_workers=self.page_workers) as executor:
+            while fetched < max_items:
+                window = range(page, page + self.page_workers)
+                for comments in executor.map(fetch_page, window):
+                    if not comments or fetched >= max_items:
+                        return
+                    fetched += len(comments)
+                    for item in comments:
+                        comment_id = _comment_id(item)
+                        if comment_id in seen_ids:
+                            continue
+                        seen_ids.add(comment_id)
+                        yield Comment(
+                            user=item.get("user", {}).get("screen_name", "匿名用户"),
+                            text=strip_tags(item.get("text", "") or item.get("text_raw", "")),
+                            ts=parse_timestamp(item.get("created_at", "")),
+                            likes=int(item.get("like_counts") or item.get("like_count") or 0),
+                        )
+                page += self.page_workers
+
+    def _fetch_comment_page(
+        self, status_id: str, page: int, referer: Optional[str] = None
+    ) -> List[Dict[str, object]]:
+        response = self._get(
+            COMMENTS_SHOW_URL, params={"id": status_id, "page": page}, referer=referer
+        )
+        payload = _decode_json(response)
+        if payload.get("ok") != 1:
+            return []
+        return (payload.get("data") or {}).get("data") or []
 
-            for item in comments:
-                comment_id = item.get("id")
-                if comment_id in seen_ids:
-                    continue
-                fetched += 1
-                yield str(comment_id), Comment(
-                    user=item.get("user", {}).get("screen_name", "匿名用户"),
-                    text=strip_tags(item.get("text", "") or item.get("text_raw", "")),
-                    ts=parse_timestamp(item.get("created_at", "")),
-                    likes=int(item.get("like_counts") or item.get("like_count") or 0),
-                )
-                if fetched >= max_comments:
-                    break
 
-            page += 1
+def _comment_id(item: Dict[str, object]) -> object:
+    """Return a comment id usable for dedup across both comment streams."""
+    raw = item.get("id") or item.get("mid")
+    # hotflow and comments/show disagree on whether ids are numbers or strings
+    return int(raw) if isinstance(raw, str) and raw.isdigit() else raw
+
+
+def _decode_json(response: requests.Response) -> Dict[str, object]:
+    """Decode a JSON body, using orjson when it is available."""
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
 
 
 def strip_tags(text: str) -> str:
     """Remove HTML tags and unescape entities from comment text."""
     if not text:
         return ""
-    soup = BeautifulSoup(text, "lxml")
-    return soup.get_text(separator="", strip=True)
+    # Matches BeautifulSoup's get_text(strip=True): each text node is stripped.
+    return "".join(html.unescape(part).strip() for part in _TAG_RE.split(text))
 
 
 def parse_timestamp(raw: str) -> str:
     """Normalize Weibo formatted timestamp into ISO8601 string."""
     if not raw:
         return ""
+    match = _TS_RE.match(raw)
+    if match and match["mon"] in _MONTHS:
+        offset = match["sign"] + match["tzh"] + match["tzm"]
+        tzinfo = _TIMEZONES.get(offset)
+        if tzinfo is None:
+            minutes = int(match["tzh"]) * 60 + int(match["tzm"])
+            delta = timedelta(minutes=-minutes if match["sign"] == "-" else minutes)
+            tzinfo = _TIMEZONES.setdefault(offset, timezone(delta))
+        try:
+            return datetime(
+                int(match["year"]),
+                _MONTHS[match["mon"]],
+                int(match["day"]),
+                int(match["hour"]),
+                int(match["minute"]),
+                int(match["second"]),
+                tzinfo=tzinfo,
+            ).isoformat()
+        except ValueError:
+            pass
+    # Unusual shapes go through the slower, locale-aware strptime.
     try:
         parsed = datetime.strptime(raw, "%a %b %d %H:%M:%S %z %Y")
         return parsed.isoformat()
@@ -232,24 +339,41 @@ def parse_timestamp(raw: str) -> str:
 
 def extract_bid(url: str) -> Optional[str]:
     """Extract the base62 post identifier from a Weibo URL."""
-    for pattern in URL_PATTERNS:
-        match = pattern.search(url)
-        if match:
-            return match.group("bid")
-    return None
+    match = URL_RE.search(url)
+    return match.group("bid") if match else None
 
 
-def get_comments(url: str, max_comments: int = 1000) -> List[Dict[str, object]]:
+def get_comments(
+    url: str, max_comments: int = 1000, client: Optional[WeiboClient] = None
+) -> List[Dict[str, object]]:
     """Public API returning normalized comments for the given Weibo URL."""
-    _, comments = fetch_post_with_comments(url, max_comments=max_comments)
+    _, comments = fetch_post_with_comments(url, max_comments=max_comments, client=client)
     return comments
 
 
 def fetch_post_with_comments(
-    url: str, max_comments: int = 1000
+    url: str, max_comments: int = 1000, client: Optional[WeiboClient] = None
 ) -> Tuple[Dict[str, object], List[Dict[str, object]]]:
-    """Return post metadata together with associated comments."""
-    client = WeiboClient()
+    """Return post metadata together with associated comments.
+
+    Pass a long-lived ``client`` to reuse its visitor cookies and pooled
+    connections across calls.
+    """
+    post_meta, comment_stream = stream_post_comments(url, max_comments=max_comments, client=client)
+    comments = [comment.to_dict() for comment in comment_stream]
+    LOGGER.info("Fetched %d comments for post %s", len(comments), post_meta["id"])
+    return post_meta, comments
+
+
+def stream_post_comments(
+    url: str, max_comments: int = 1000, client: Optional[WeiboClient] = None
+) -> Tuple[Dict[str, object], Iterator[Comment]]:
+    """Return post metadata and a lazy iterator over its comments.
+
+    Comment pages are only requested as the iterator is consumed, so callers
+    can analyse and store comments batch by batch while crawling continues.
+    """
+    client = client or WeiboClient()
     bid = extract_bid(url)
     if not bid:
         raise ValueError(f"Unable to parse Weibo ID from url: {url}")
@@ -259,14 +383,15 @@ def fetch_post_with_comments(
     if not status_id:
         raise RuntimeError("Status response missing numeric id.")
 
-    comments = [comment.to_dict() for comment in client.iter_comments(status_id, max_comments)]
-    LOGGER.info("Fetched %d comments for post %s", len(comments), status_id)
+    comments = client.iter_comments(
+        status_id, max_comments, referer=f"https://m.weibo.cn/status/{bid}"
+    )
     return build_post_meta(status, url), comments
 
 
-def get_post_meta(url: str) -> Dict[str, object]:
+def get_post_meta(url: str, client: Optional[WeiboClient] = None) -> Dict[str, object]:
     """Return metadata for the given Weibo URL."""
-    client = WeiboClient()
+    client = client or WeiboClient()
     bid = extract_bid(url)
     if not bid:
         raise ValueError(f"Unable to parse Weibo ID from url: {url}")
@@ -289,4 +414,11 @@ def build_post_meta(status: Dict[str, object], url: str) -> Dict[str, object]:
     }
 
 
-__all__ = ["get_comments", "get_post_meta", "fetch_post_with_comments", "Comment"]
+__all__ = [
+    "get_comments",
+    "get_post_meta",
+    "fetch_post_with_comments",
+    "stream_post_comments",
+    "Comment",
+    "WeiboClient",
+]
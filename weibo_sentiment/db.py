@@ -4,22 +4,79 @@ from __future__ import annotations
 
 import contextlib
 import sqlite3
+import threading
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Sequence
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
 
 DB_PATH = Path(__file__).resolve().with_name("sentiment.db")
 
+# Serializes use of the shared connection across Streamlit session threads.
+_LOCK = threading.RLock()
+# UPSERT ... RETURNING needs SQLite 3.35+.
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+_REFRESH_SUMMARY_SQL = """
+    INSERT OR REPLACE INTO post_emotion_summary (
+        post_id, anger, disgust, fear, joy, sadness, surprise
+    )
+    SELECT
+        comments.post_id,
+        AVG(emotions.anger),
+        AVG(emotions.disgust),
+        AVG(emotions.fear),
+        AVG(emotions.joy),
+        AVG(emotions.sadness),
+        AVG(emotions.surprise)
+    FROM emotions
+    JOIN comments ON emotions.comment_id = comments.id
+    WHERE comments.post_id IN (
+        SELECT DISTINCT post_id FROM comments WHERE id BETWEEN ? AND ?
+    )
+    GROUP BY comments.post_id;
+"""
+
 
 def get_connection(db_path: Path = DB_PATH) -> sqlite3.Connection:
-    """Create a SQLite connection with sensible defaults."""
-    conn = sqlite3.connect(db_path)
+    """Create a SQLite connection with sensible defaults.
+
+    The connection may be shared across Streamlit script threads, so the
+    same-thread check is disabled.
+    """
+    conn = sqlite3.connect(db_path, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute("PRAGMA mmap_size=268435456;")
+    conn.execute("PRAGMA foreign_keys=ON;")
+    return conn
+
+
+def get_conn(db_path: Path = DB_PATH) -> sqlite3.Connection:
+    """Return the process-wide connection for ``db_path``, creating tables on first use."""
+    return _shared_connection(Path(db_path).resolve())
+
+
+@lru_cache(maxsize=None)
+def _shared_connection(db_path: Path) -> sqlite3.Connection:
+    conn = get_connection(db_path)
+    init_db(conn=conn)
     return conn
 
 
-def init_db(db_path: Path = DB_PATH) -> None:
+@contextlib.contextmanager
+def _use_connection(
+    conn: Optional[sqlite3.Connection], db_path: Path = DB_PATH
+) -> Iterator[sqlite3.Connection]:
+    """Yield ``conn`` (or the shared connection) while holding the module lock."""
+    with _LOCK:
+        yield conn if conn is not None else get_conn(db_path)
+
+
+def init_db(db_path: Path = DB_PATH, conn: Optional[sqlite3.Connection] = None) -> None:
     """Create database tables when they do not already exist."""
-    with contextlib.closing(get_connection(db_path)) as conn:
+    with _use_connection(conn, db_path) as conn, conn:
         cursor = conn.cursor()
         cursor.execute(
             """
@@ -39,7 +96,7 @@ def init_db(db_path: Path = DB_PATH) -> None:
             """
             CREATE TABLE IF NOT EXISTS comments (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                post_id INTEGER,
+                post_id INTEGER NOT NULL,
                 user TEXT,
                 text TEXT,
                 ts TEXT,
@@ -62,6 +119,25 @@ def init_db(db_path: Path = DB_PATH) -> None:
             );
             """
         )
+        # comments.id is the rowid, so this index already covers (post_id, id);
+        # emotions.comment_id needs none because it is the table's primary key.
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_comments_post_id ON comments (post_id);"
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS post_emotion_summary (
+                post_id INTEGER PRIMARY KEY,
+                anger REAL,
+                disgust REAL,
+                fear REAL,
+                joy REAL,
+                sadness REAL,
+                surprise REAL,
+                FOREIGN KEY (post_id) REFERENCES posts (id)
+            );
+            """
+        )
         cursor.execute(
             """
             CREATE TABLE IF NOT EXISTS users (
@@ -74,13 +150,27 @@ def init_db(db_path: Path = DB_PATH) -> None:
             );
             """
         )
-        conn.commit()
 
 
-def insert_post(meta: Dict[str, Optional[str]]) -> int:
+def insert_post(
+    meta: Dict[str, Optional[str]], conn: Optional[sqlite3.Connection] = None
+) -> int:
     """Insert metadata for a Weibo post and return its primary key."""
-    with contextlib.closing(get_connection()) as conn:
+    with _use_connection(conn) as conn, conn:
         cursor = conn.cursor()
+        if _HAS_RETURNING:
+            # The no-op update makes RETURNING yield the id of an existing URL too.
+            rows = cursor.execute(
+                """
+                INSERT INTO posts (url, title, topic, like_cnt, repost_cnt, comment_cnt)
+                VALUES (:url, :title, :topic, :like_cnt, :repost_cnt, :comment_cnt)
+                ON CONFLICT (url) DO UPDATE SET url = excluded.url
+                RETURNING id;
+                """,
+                meta,
+            ).fetchall()
+            return rows[0]["id"]
+
         cursor.execute(
             """
             INSERT OR IGNORE INTO posts (url, title, topic, like_cnt, repost_cnt, comment_cnt)
@@ -88,102 +178,176 @@ def insert_post(meta: Dict[str, Optional[str]]) -> int:
             """,
             meta,
         )
-        if cursor.lastrowid:
+        # lastrowid is connection-wide and goes stale when the insert is ignored.
+        if cursor.rowcount:
             post_id = cursor.lastrowid
         else:
             cursor.execute("SELECT id FROM posts WHERE url = ?", (meta.get("url"),))
             row = cursor.fetchone()
             post_id = row["id"] if row else -1
-        conn.commit()
     return post_id
 
 
-def insert_comments(post_id: int, comments: Iterable[Dict[str, Optional[str]]]) -> List[int]:
+def update_comment_count(
+    post_id: int, comment_cnt: int, conn: Optional[sqlite3.Connection] = None
+) -> None:
+    """Record how many comments were collected for a post."""
+    with _use_connection(conn) as conn, conn:
+        conn.execute("UPDATE posts SET comment_cnt = ? WHERE id = ?;", (comment_cnt, post_id))
+
+
+def insert_comments(
+    post_id: int,
+    comments: Iterable[Dict[str, Optional[str]]],
+    conn: Optional[sqlite3.Connection] = None,
+) -> List[int]:
     """Persist comments and return the generated comment IDs."""
-    comment_ids: List[int] = []
-    with contextlib.closing(get_connection()) as conn:
-        cursor = conn.cursor()
-        for payload in comments:
-            cursor.execute(
-                """
-                INSERT INTO comments (post_id, user, text, ts)
-                VALUES (?, ?, ?, ?);
-                """,
-                (
-                    post_id,
-                    payload.get("user"),
-                    payload.get("text"),
-                    payload.get("ts"),
-                ),
-            )
-            comment_ids.append(cursor.lastrowid)
-        conn.commit()
-    return comment_ids
+    with _use_connection(conn) as conn, conn:
+        return _insert_comment_rows(conn, post_id, comments)
 
 
 def insert_emotions(
     prob_list: Sequence[Sequence[float]],
     label_list: Sequence[Sequence[str]],
     comment_ids: Sequence[int],
+    conn: Optional[sqlite3.Connection] = None,
+) -> None:
+    """Persist emotion probabilities and top labels associated with comments.
+
+    The per-post averages in ``post_emotion_summary`` are refreshed in the
+    same transaction so history views can read them without aggregating.
+    """
+    with _use_connection(conn) as conn, conn:
+        _insert_emotion_rows(conn, prob_list, label_list, comment_ids)
+
+
+def insert_analyzed_comments(
+    post_id: int,
+    comments: Sequence[Dict[str, Optional[str]]],
+    prob_list: Sequence[Sequence[float]],
+    label_list: Sequence[Sequence[str]],
+    conn: Optional[sqlite3.Connection] = None,
+) -> List[int]:
+    """Persist a batch of comments and their emotions in one transaction."""
+    with _use_connection(conn) as conn, conn:
+        comment_ids = _insert_comment_rows(conn, post_id, comments)
+        _insert_emotion_rows(conn, prob_list, label_list, comment_ids)
+    return comment_ids
+
+
+def _insert_comment_rows(
+    conn: sqlite3.Connection, post_id: int, comments: Iterable[Dict[str, Optional[str]]]
+) -> List[int]:
+    rows = [
+        (post_id, payload.get("user"), payload.get("text"), payload.get("ts"))
+        for payload in comments
+    ]
+    if not rows:
+        return []
+
+    cursor = conn.cursor()
+    cursor.executemany(
+        """
+        INSERT INTO comments (post_id, user, text, ts)
+        VALUES (?, ?, ?, ?);
+        """,
+        rows,
+    )
+    # AUTOINCREMENT ids are contiguous within a single write transaction.
+    last_id = cursor.execute("SELECT last_insert_rowid();").fetchone()[0]
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+
+def _insert_emotion_rows(
+    conn: sqlite3.Connection,
+    prob_list: Sequence[Sequence[float]],
+    label_list: Sequence[Sequence[str]],
+    comment_ids: Sequence[int],
 ) -> None:
-    """Persist emotion probabilities and top labels associated with comments."""
     if not (len(prob_list) == len(label_list) == len(comment_ids)):
         raise ValueError("prob_list, label_list, and comment_ids must have the same length")
+    if not comment_ids:
+        return
 
-    with contextlib.closing(get_connection()) as conn:
-        cursor = conn.cursor()
-        for probs, labels, comment_id in zip(prob_list, label_list, comment_ids):
-            payload = dict(zip(["anger", "disgust", "fear", "joy", "sadness", "surprise"], probs))
-            cursor.execute(
-                """
-                INSERT OR REPLACE INTO emotions (
-                    comment_id, anger, disgust, fear, joy, sadness, surprise, top_labels
-                )
-                VALUES (:comment_id, :anger, :disgust, :fear, :joy, :sadness, :surprise, :top_labels);
-                """,
-                {
-                    "comment_id": comment_id,
-                    **payload,
-                    "top_labels": ",".join(labels),
-                },
-            )
-        conn.commit()
+    rows = [
+        (comment_id, *probs, ",".join(labels))
+        for probs, labels, comment_id in zip(prob_list, label_list, comment_ids)
+    ]
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO emotions (
+            comment_id, anger, disgust, fear, joy, sadness, surprise, top_labels
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+        """,
+        rows,
+    )
+    conn.execute(_REFRESH_SUMMARY_SQL, (min(comment_ids), max(comment_ids)))
 
 
-def get_emotion_dist(post_id: int) -> Dict[str, float]:
+def get_emotion_dist(
+    post_id: int, conn: Optional[sqlite3.Connection] = None
+) -> Dict[str, float]:
     """Return aggregate emotion distribution for a given post."""
-    with contextlib.closing(get_connection()) as conn:
+    with _use_connection(conn) as conn:
         cursor = conn.cursor()
         cursor.execute(
             """
-            SELECT
-                AVG(anger) AS anger,
-                AVG(disgust) AS disgust,
-                AVG(fear) AS fear,
-                AVG(joy) AS joy,
-                AVG(sadness) AS sadness,
-                AVG(surprise) AS surprise
-            FROM emotions
-            JOIN comments ON emotions.comment_id = comments.id
-            WHERE comments.post_id = ?;
+            SELECT anger, disgust, fear, joy, sadness, surprise
+            FROM post_emotion_summary
+            WHERE post_id = ?;
             """,
             (post_id,),
         )
         row = cursor.fetchone()
+        if row is None:
+            # Posts stored before the summary table existed are aggregated on demand.
+            cursor.execute(
+                """
+                SELECT
+                    AVG(anger) AS anger,
+                    AVG(disgust) AS disgust,
+                    AVG(fear) AS fear,
+                    AVG(joy) AS joy,
+                    AVG(sadness) AS sadness,
+                    AVG(surprise) AS surprise
+                FROM emotions
+                JOIN comments ON emotions.comment_id = comments.id
+                WHERE comments.post_id = ?;
+                """,
+                (post_id,),
+            )
+            row = cursor.fetchone()
         if row is None:
             return {}
         return {key: row[key] for key in row.keys() if row[key] is not None}
 
 
-def get_recent_posts(limit: int = 10):
-    """Fetch recent posts for history view."""
-    with contextlib.closing(get_connection()) as conn:
+def get_recent_posts(limit: int = 10, conn: Optional[sqlite3.Connection] = None):
+    """Fetch recent posts for history view.
+
+    Each row carries the stored comment count and the post's emotion averages
+    (NULL for posts analysed before the summary table existed).
+    """
+    with _use_connection(conn) as conn:
         cursor = conn.cursor()
         cursor.execute(
             """
-            SELECT id, title, url, topic, created_at, comment_cnt
-            FROM posts
-            ORDER BY created_at DESC
+            SELECT p.id,
+                   p.title,
+                   p.url,
+                   p.topic,
+                   p.created_at,
+                   (SELECT COUNT(*) FROM comments c WHERE c.post_id = p.id) AS comment_cnt,
+                   s.anger,
+                   s.disgust,
+                   s.fear,
+                   s.joy,
+                   s.sadness,
+                   s.surprise
+            FROM posts p
+            LEFT JOIN post_emotion_summary s ON s.post_id = p.id
+            ORDER BY p.created_at DESC
             LIMIT ?;
             """,
             (limit,),
@@ -191,9 +355,9 @@ def get_recent_posts(limit: int = 10):
         return cursor.fetchall()
 
 
-def get_comments_with_emotions(post_id: int):
+def get_comments_with_emotions(post_id: int, conn: Optional[sqlite3.Connection] = None):
     """Return comments and attached emotion scores for a given post."""
-    with contextlib.closing(get_connection()) as conn:
+    with _use_connection(conn) as conn:
         cursor = conn.cursor()
         cursor.execute(
             """
@@ -3,17 +3,50 @@
 from __future__ import annotations
 
 import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from functools import lru_cache
-from typing import Iterable, List, Sequence, Tuple
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
 import numpy as np
 
+try:
+    import ahocorasick
+except ImportError:  # pragma: no cover - fallback when pyahocorasick not installed
+    ahocorasick = None
+
 LOGGER = logging.getLogger(__name__)
 
 EMOTIONS: Tuple[str, ...] = ("anger", "disgust", "fear", "joy", "sadness", "surprise")
 CHINESE_LABELS: Tuple[str, ...] = ("愤怒", "厌恶", "恐惧", "喜悦", "悲伤", "惊讶")
+EMOTIONS_ARR = np.array(EMOTIONS)
+HYPOTHESIS_TEMPLATE = "这段话表达了{}的情绪。"
+# 六个假设句在导入时格式化一次，分词时直接复用
+_HYPOTHESES: Tuple[str, ...] = tuple(
+    HYPOTHESIS_TEMPLATE.format(label) for label in CHINESE_LABELS
+)
 
 MODEL_NAME = "IDEA-CCNL/Erlangshen-RoBERTa-330M-NLI"
+DEFAULT_BATCH_SIZE = 32
+# 短于该长度的评论（单字、表情残留）不值得跑 NLI 模型
+MIN_MODEL_TEXT_LENGTH = 2
+# 设为 1 时用 torch.compile 包装模型（需要本地 C/C++ 编译工具链），默认关闭
+COMPILE_ENV_VAR = "WEIBO_SENTIMENT_COMPILE"
+# 模型加载失败后，间隔这么多秒再重试，避免每个批次都重新下载/加载
+LOAD_RETRY_INTERVAL = 300.0
+# 微博评论通常很短，premise + hypothesis 截断到 128 token 足够，远小于模型的 512
+MAX_SEQ_LENGTH = 128
+# CPU 上 int8 动态量化后，校准句的 entailment 概率最多允许偏离这么多
+QUANTIZE_MAX_DRIFT = 0.05
+CALIBRATION_TEXTS: Tuple[str, ...] = (
+    "气死我了，这什么垃圾服务",
+    "看着就恶心，别再发了",
+    "好担心明天的考试",
+    "太好了，终于放假了哈哈",
+    "看哭了，心疼",
+    "没想到竟然是这样的结局",
+)
 
 
 @dataclass
@@ -25,91 +58,239 @@ class PredictionResult:
 class SentimentAnalyzer:
     """Lazy loading zero-shot classifier with keyword fallback."""
 
-    def __init__(self, model_name: str = MODEL_NAME) -> None:
+    def __init__(
+        self,
+        model_name: str = MODEL_NAME,
+        compile_model: bool = False,
+        quantize_cpu: bool = True,
+    ) -> None:
         self.model_name = model_name
-        self._pipeline = None
+        self.compile_model = compile_model
+        self.quantize_cpu = quantize_cpu
+        self._model = None
+        self._tokenizer = None
+        self._device = None
+        self._nli_ids: Tuple[int, int] = (0, -1)
+        self._load_failed_at: float | None = None
         self._error: str | None = None
 
-    def predict(self, texts: Sequence[str], thresh: float = 0.5) -> PredictionResult:
-        cleaned = [text.strip() for text in texts if text and text.strip()]
+    def predict(
+        self,
+        texts: Sequence[str],
+        thresh: float = 0.5,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> PredictionResult:
+        cleaned = [stripped for text in texts if text and (stripped := text.strip())]
         if not cleaned:
             return PredictionResult([], [])
 
-        pipeline = self._load_pipeline()
-        if pipeline is not None:
+        # 转发、"哈哈哈" 等重复评论只推理一次，再按逆索引散回原位置
+        unique, inverse = np.unique(
+            np.asarray(cleaned, dtype=object), return_inverse=True
+        )
+        result = self._predict_texts(unique.tolist(), thresh, batch_size)
+        positions = inverse.tolist()
+        return PredictionResult(
+            probabilities=[result.probabilities[idx] for idx in positions],
+            labels=[result.labels[idx] for idx in positions],
+        )
+
+    def warm_up(self) -> None:
+        """Load the underlying model eagerly so the first prediction is fast."""
+        self._load_model()
+
+    def _predict_texts(
+        self, texts: List[str], thresh: float, batch_size: int
+    ) -> PredictionResult:
+        if all(len(text) < MIN_MODEL_TEXT_LENGTH for text in texts):
+            return self._predict_keyword(texts, thresh)
+
+        if self._load_model():
             try:
-                return self._predict_pipeline(pipeline, cleaned, thresh)
+                return self._predict_model(texts, thresh, batch_size)
             except Exception as exc:  # pragma: no cover - logging only
-                self._error = f"HuggingFace pipeline inference failed: {exc}"
+                self._error = f"HuggingFace model inference failed: {exc}"
                 LOGGER.exception(self._error)
 
         LOGGER.info("Falling back to keyword heuristic sentiment classification.")
-        return self._predict_keyword(cleaned, thresh)
-
-    def _predict_pipeline(self, pipeline, texts: Sequence[str], thresh: float) -> PredictionResult:
-        outputs = pipeline(
-            list(texts),
-            candidate_labels=list(CHINESE_LABELS),
-            hypothesis_template="这段话表达了{}的情绪。",
-            multi_label=True,
-        )
-
-        if not isinstance(outputs, list):  # Single input returns dict
-            outputs = [outputs]
-
-        probabilities: List[List[float]] = []
-        label_groups: List[List[str]] = []
-
-        for result in outputs:
-            # Multi-label输出会按分数降序排列，需要映射回候选标签顺序
-            label_scores = {
-                label: score for label, score in zip(result["labels"], result["scores"])
-            }
-            scores = [
-                label_scores.get(ch_label, 0.0) for ch_label in CHINESE_LABELS
-            ]
-            selected_labels = [
-                EMOTIONS[idx] for idx, score in enumerate(scores) if score >= thresh
-            ]
-            if not selected_labels:
-                selected_labels = [EMOTIONS[int(np.argmax(scores))]]
-            probabilities.append(scores)
-            label_groups.append(selected_labels)
+        return self._predict_keyword(texts, thresh)
+
+    def _predict_model(
+        self, texts: List[str], thresh: float, batch_size: int
+    ) -> PredictionResult:
+        # 按长度排序后分批，每个 batch 只需 padding 到相近长度
+        order = sorted(range(len(texts)), key=lambda idx: len(texts[idx]))
+        chunks = [
+            order[start : start + batch_size]
+            for start in range(0, len(order), batch_size)
+        ]
+        probabilities: List[List[float]] = [[] for _ in texts]
+        label_groups: List[List[str]] = [[] for _ in texts]
+        # 每个 batch 出结果后立即选标签并写回原位置，不保留整批的分数矩阵
+        for positions, scores in zip(
+            chunks,
+            self._iter_entailment_scores(
+                self._model, [[texts[idx] for idx in chunk] for chunk in chunks]
+            ),
+        ):
+            for position, row, labels in zip(
+                positions, scores.tolist(), _select_labels(scores, thresh)
+            ):
+                probabilities[position] = row
+                label_groups[position] = labels
 
         return PredictionResult(probabilities=probabilities, labels=label_groups)
 
-    def _load_pipeline(self):
-        if self._pipeline is not None:
-            return self._pipeline
+    def _iter_entailment_scores(
+        self, model, chunks: Sequence[Sequence[str]]
+    ) -> Iterator[np.ndarray]:
+        """Yield scores per chunk while the next chunk is tokenized in background."""
+        if not chunks:
+            return
+        # 快速分词器与 torch 前向都会释放 GIL，下一批的分词可与当前前向重叠
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = executor.submit(self._encode, chunks[0])
+            for idx, chunk in enumerate(chunks):
+                encoded = pending.result()
+                if idx + 1 < len(chunks):
+                    pending = executor.submit(self._encode, chunks[idx + 1])
+                yield self._score(model, encoded, len(chunk))
+
+    def _entailment_scores(self, model, texts: Sequence[str]) -> np.ndarray:
+        """Return a ``(len(texts), 6)`` matrix of entailment probabilities."""
+        return self._score(model, self._encode(texts), len(texts))
+
+    def _encode(self, texts: Sequence[str]):
+        # 每条评论与六个情绪假设组成 (premise, hypothesis) 对，一次分词、一次前向
+        premises = [text for text in texts for _ in CHINESE_LABELS]
+        return self._tokenizer(
+            premises,
+            list(_HYPOTHESES) * len(texts),
+            padding="longest",
+            truncation="only_first",
+            max_length=MAX_SEQ_LENGTH,
+            return_tensors="pt",
+        )
+
+    def _score(self, model, encoded, num_texts: int) -> np.ndarray:
+        import torch
+
+        contradiction_id, entailment_id = self._nli_ids
+        # inference_mode 比 no_grad 更省：不记录 autograd 与视图版本
+        with torch.inference_mode():
+            logits = model(**encoded.to(self._device)).logits.float()
+        # 与 zero-shot pipeline 的 multi_label 一致：每个标签在
+        # [contradiction, entailment] 上单独 softmax，取 entailment 概率
+        logits = logits.view(num_texts, len(CHINESE_LABELS), -1)
+        pair_logits = logits[..., [contradiction_id, entailment_id]]
+        return pair_logits.softmax(dim=-1)[..., 1].cpu().numpy()
+
+    def _load_model(self) -> bool:
+        if self._model is not None:
+            return True
+        if (
+            self._load_failed_at is not None
+            and time.monotonic() - self._load_failed_at < LOAD_RETRY_INTERVAL
+        ):
+            return False
 
         try:
-            from transformers import pipeline
-
-            self._pipeline = pipeline(
-                "zero-shot-classification",
-                model=self.model_name,
-                device=-1,
+            import torch
+            from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+            # 有 CUDA 时放到 GPU 并用 fp16，否则保持 CPU fp32
+            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            dtype = torch.float16 if device.type == "cuda" else torch.float32
+            tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            model = AutoModelForSequenceClassification.from_pretrained(
+                self.model_name, dtype=dtype
             )
+            model = model.to(device).eval()
+            self._nli_ids = _nli_label_ids(model.config.label2id)
+            self._tokenizer = tokenizer
+            self._device = device
+            if self.quantize_cpu and device.type == "cpu":
+                model = self._quantize(model)
+            if self.compile_model:
+                model = _compile_model(model, tokenizer, device)
+            self._model = model
+            self._load_failed_at = None
         except Exception as exc:  # pragma: no cover - handled via fallback
-            self._error = f"Failed to load HF pipeline: {exc}"
+            # 记录失败时间，冷却期内直接走关键词回退，之后再重试
+            self._error = f"Failed to load HF model: {exc}"
             LOGGER.warning(self._error)
-            self._pipeline = None
-        return self._pipeline
+            self._model = None
+            self._load_failed_at = time.monotonic()
+        return self._model is not None
+
+    def _quantize(self, model):
+        """Quantize Linear layers to int8 unless calibration scores drift."""
+        import torch
+        from torch.ao.quantization import quantize_dynamic
+
+        try:
+            quantized = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            drift = float(
+                np.abs(
+                    self._entailment_scores(quantized, CALIBRATION_TEXTS)
+                    - self._entailment_scores(model, CALIBRATION_TEXTS)
+                ).max()
+            )
+        except Exception as exc:  # pragma: no cover - depends on torch build
+            LOGGER.warning("int8 quantization failed, using fp32 model: %s", exc)
+            return model
+        if drift > QUANTIZE_MAX_DRIFT:
+            LOGGER.warning(
+                "int8 model drifts %.3f from fp32 on calibration texts; using fp32.",
+                drift,
+            )
+            return model
+        return quantized
 
     @staticmethod
     def _predict_keyword(texts: Sequence[str], thresh: float) -> PredictionResult:
-        probabilities: List[List[float]] = []
-        label_groups: List[List[str]] = []
-        for text in texts:
-            scores = heuristic_scores(text)
-            probabilities.append(scores)
-            candidates = [
-                EMOTIONS[idx] for idx, score in enumerate(scores) if score >= thresh
-            ]
-            if not candidates:
-                candidates = [EMOTIONS[int(np.argmax(scores))]]
-            label_groups.append(candidates)
-        return PredictionResult(probabilities=probabilities, labels=label_groups)
+        scores = np.asarray(
+            [heuristic_scores(text) for text in texts], dtype=np.float32
+        )
+        return PredictionResult(
+            probabilities=scores.tolist(), labels=_select_labels(scores, thresh)
+        )
+
+
+def _compile_model(model, tokenizer, device):
+    """Wrap ``model`` with ``torch.compile``; keep the eager model on failure."""
+    import torch
+
+    try:
+        compiled = torch.compile(model, dynamic=True)
+        # 编译在首次前向时才发生，先用一对短句预热，失败就退回 eager 模型
+        encoded = tokenizer(["预热"], [_HYPOTHESES[0]], return_tensors="pt").to(device)
+        with torch.inference_mode():
+            compiled(**encoded)
+    except Exception as exc:  # pragma: no cover - depends on local toolchain
+        LOGGER.warning("torch.compile failed, using eager model: %s", exc)
+        return model
+    return compiled
+
+
+def _nli_label_ids(label2id: Dict[str, int]) -> Tuple[int, int]:
+    """Return ``(contradiction_id, entailment_id)`` for an NLI model config."""
+    entailment_id = -1
+    for label, idx in label2id.items():
+        if label.lower().startswith("entail"):
+            entailment_id = idx
+            break
+    contradiction_id = -1 if entailment_id == 0 else 0
+    return contradiction_id, entailment_id
+
+
+def _select_labels(scores: np.ndarray, thresh: float) -> List[List[str]]:
+    """Pick labels scoring at least ``thresh``; fall back to the top label."""
+    mask = scores >= thresh
+    # 整批一次比较；没有标签过阈值的行用最高分标签兜底
+    missing = np.flatnonzero(~mask.any(axis=1))
+    mask[missing, scores[missing].argmax(axis=1)] = True
+    return [EMOTIONS_ARR[row].tolist() for row in mask]
 
 
 FALLBACK_KEYWORDS = {
@@ -122,25 +303,70 @@ FALLBACK_KEYWORDS = {
 }
 
 
+# 关键词只在导入时转小写一次，按 EMOTIONS 顺序分组
+_KEYWORDS_BY_EMOTION: Tuple[Tuple[str, ...], ...] = tuple(
+    tuple(word.lower() for word in FALLBACK_KEYWORDS.get(emotion, ()))
+    for emotion in EMOTIONS
+)
+
+
+def _build_automaton():
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    pattern_id = 0
+    for emotion_idx, keywords in enumerate(_KEYWORDS_BY_EMOTION):
+        for word in keywords:
+            automaton.add_word(word, (pattern_id, emotion_idx, len(word)))
+            pattern_id += 1
+    automaton.make_automaton()
+    return automaton
+
+
+_AUTOMATON = _build_automaton()
+
+
+def _count_hits(lowered: str) -> List[int]:
+    if _AUTOMATON is None:
+        return [
+            sum(lowered.count(word) for word in keywords)
+            for keywords in _KEYWORDS_BY_EMOTION
+        ]
+    # 单次扫描文本，匹配到的关键词按情绪归桶；自动机会报告重叠匹配，
+    # 按关键词记录上次匹配的结束位置并跳过重叠部分，与 str.count 计数一致
+    hits = [0] * len(EMOTIONS)
+    next_start: Dict[int, int] = {}
+    for end, (pattern_id, emotion_idx, length) in _AUTOMATON.iter(lowered):
+        start = end - length + 1
+        if start < next_start.get(pattern_id, 0):
+            continue
+        next_start[pattern_id] = end + 1
+        hits[emotion_idx] += 1
+    return hits
+
+
 def heuristic_scores(text: str) -> List[float]:
-    lowered = text.lower()
-    scores = []
-    for emotion in EMOTIONS:
-        keywords = FALLBACK_KEYWORDS.get(emotion, ())
-        hits = sum(lowered.count(word.lower()) for word in keywords)
-        scores.append(min(1.0, hits / 3.0))
+    scores = [min(1.0, hits / 3.0) for hits in _count_hits(text.lower())]
     total = sum(scores)
     if total == 0:
         return [1 / len(EMOTIONS)] * len(EMOTIONS)
     return [score / total for score in scores]
 
 
-_ANALYZER = SentimentAnalyzer()
+@lru_cache(maxsize=1)
+def get_analyzer() -> SentimentAnalyzer:
+    """Return the process-wide analyzer so model weights load only once."""
+    compile_model = os.environ.get(COMPILE_ENV_VAR, "").lower() in ("1", "true", "yes")
+    return SentimentAnalyzer(compile_model=compile_model)
 
 
-def predict(texts: Sequence[str], thresh: float = 0.5) -> Tuple[List[List[float]], List[List[str]]]:
-    result = _ANALYZER.predict(texts, thresh=thresh)
+def predict(
+    texts: Sequence[str],
+    thresh: float = 0.5,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Tuple[List[List[float]], List[List[str]]]:
+    result = get_analyzer().predict(texts, thresh=thresh, batch_size=batch_size)
     return result.probabilities, result.labels
 
 
-__all__ = ["predict", "SentimentAnalyzer", "EMOTIONS"]
+__all__ = ["predict", "get_analyzer", "SentimentAnalyzer", "EMOTIONS"]
@@ -3,20 +3,38 @@
 from __future__ import annotations
 
 from collections import Counter
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Sequence
-
-import matplotlib.pyplot as plt
-from matplotlib import font_manager, rcParams
-from wordcloud import WordCloud
-
-try:
-    import jieba
-except ImportError:  # pragma: no cover - fallback when jieba not installed
-    jieba = None
-
-
-def _resolve_chinese_font() -> Optional[str]:
+from types import ModuleType
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+# matplotlib / wordcloud / jieba 体积大，只在真正绘图或分词时导入
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+    from matplotlib.font_manager import FontProperties
+
+
+@lru_cache(maxsize=1)
+def _get_jieba() -> Optional[ModuleType]:
+    """Import jieba on first tokenization; ``None`` when it is not installed."""
+    try:
+        import jieba
+    except ImportError:  # pragma: no cover - fallback when jieba not installed
+        return None
+    return jieba
+
+
+@lru_cache(maxsize=1)
+def _get_font_path() -> Optional[str]:
     """Return a font path that supports Chinese characters."""
     candidates = [
         Path("C:/Windows/Fonts/msyh.ttc"),
@@ -29,6 +47,8 @@ def _resolve_chinese_font() -> Optional[str]:
         if path.exists():
             return str(path)
 
+    from matplotlib import font_manager
+
     for font in font_manager.findSystemFonts(fontext="ttf"):
         lower = font.lower()
         if any(name in lower for name in ["msyh", "simhei", "hei", "pingfang", "noto"]):
@@ -36,43 +56,65 @@ def _resolve_chinese_font() -> Optional[str]:
     return None
 
 
-FONT_PATH = _resolve_chinese_font()
-FONT_PROP = font_manager.FontProperties(fname=FONT_PATH) if FONT_PATH else None
-if FONT_PROP:
-    rcParams["font.family"] = FONT_PROP.get_name()
+@lru_cache(maxsize=1)
+def _font_prop() -> Optional[FontProperties]:
+    """Resolve the Chinese font on first draw and apply it to rcParams once."""
+    font_path = _get_font_path()
+    if not font_path:
+        return None
+    from matplotlib import font_manager, rcParams
+
+    font_prop = font_manager.FontProperties(fname=font_path)
+    rcParams["font.family"] = font_prop.get_name()
     rcParams["axes.unicode_minus"] = False
+    return font_prop
 
 
-def draw_pie(emotion_dist: Dict[str, float]) -> plt.Figure:
+def draw_pie(emotion_dist: Dict[str, float]) -> Figure:
     """Render a pie chart from an emotion distribution dictionary."""
+    import matplotlib.pyplot as plt
+
+    font_prop = _font_prop()
     labels = list(emotion_dist.keys())
     values = [emotion_dist[label] for label in labels]
     figure, ax = plt.subplots(figsize=(4, 4))
     ax.pie(values, labels=labels, autopct="%1.1f%%", startangle=150)
     ax.axis("equal")
-    if FONT_PROP:
-        ax.set_title("情绪分布", fontproperties=FONT_PROP)
+    if font_prop:
+        ax.set_title("情绪分布", fontproperties=font_prop)
     else:
         ax.set_title("情绪分布")
     return figure
 
 
-def draw_wordcloud(texts: Sequence[str]) -> plt.Figure:
+def draw_wordcloud(texts: Sequence[str]) -> Figure:
     """Render a word cloud based on tokenized comments."""
-    tokens = tokenize(texts)
-    freq = Counter(tokens)
+    return draw_wordcloud_from_frequencies(word_frequencies(texts))
+
+
+def word_frequencies(texts: Sequence[str]) -> Counter:
+    """Count token occurrences across comments."""
+    return Counter(iter_tokens(texts))
+
+
+def draw_wordcloud_from_frequencies(freq: Dict[str, int]) -> Figure:
+    """Render a word cloud from precomputed token frequencies."""
+    import matplotlib.pyplot as plt
+    from wordcloud import WordCloud
+
+    font_prop = _font_prop()
     wc = WordCloud(
         width=800,
         height=400,
-        font_path=FONT_PATH,
+        font_path=_get_font_path(),
         background_color="white",
     ).generate_from_frequencies(freq)
 
     figure, ax = plt.subplots(figsize=(8, 4))
     ax.imshow(wc, interpolation="bilinear")
     ax.axis("off")
-    if FONT_PROP:
-        ax.set_title("评论词云", fontproperties=FONT_PROP)
+    if font_prop:
+        ax.set_title("评论词云", fontproperties=font_prop)
     else:
         ax.set_title("评论词云")
     return figure
@@ -80,15 +122,32 @@ def draw_wordcloud(texts: Sequence[str]) -> plt.Figure:
 
 def tokenize(texts: Sequence[str]) -> List[str]:
     """Segment text into tokens. Falls back to whitespace splits."""
-    tokens: List[str] = []
+    return list(iter_tokens(texts))
+
+
+def iter_tokens(texts: Iterable[str]) -> Iterator[str]:
+    """Yield tokens comment by comment without building a full token list."""
+    jieba = _get_jieba()
     for text in texts:
         if not text:
             continue
         if jieba:
-            tokens.extend(word.strip() for word in jieba.cut(text) if word.strip())
+            yield from _cut_one(text)
         else:
-            tokens.extend(text.strip().split())
-    return tokens
+            yield from text.strip().split()
+
+
+@lru_cache(maxsize=50_000)
+def _cut_one(text: str) -> Tuple[str, ...]:
+    """Segment one comment with jieba; repeated texts skip re-segmentation."""
+    return tuple(word.strip() for word in _get_jieba().cut(text) if word.strip())
 
 
-__all__ = ["draw_pie", "draw_wordcloud", "tokenize"]
+__all__ = [
+    "draw_pie",
+    "draw_wordcloud",
+    "draw_wordcloud_from_frequencies",
+    "iter_tokens",
+    "tokenize",
+    "word_frequencies",
+]